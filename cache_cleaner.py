@@ -3,13 +3,87 @@ System Cache Cleanup Module
 Cleans up various system and application caches to free disk space
 """
 import os
+import re
+import json
 import shutil
+import stat
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import logging
 
 logger = logging.getLogger(__name__)
 
+BREW_FREED_RE = re.compile(r'==> This operation has freed approximately ([\d.]+)\s*([KMG]?B)')
+UNIT_TO_MB = {'B': 1 / (1024 * 1024), 'KB': 1 / 1024, 'MB': 1, 'GB': 1024}
+STDERR_LOG_LIMIT = 2000  # Characters of tool stderr to include in warnings
+DIR_SIZE_CACHE_FILE = Path("~/.cache/mac-cleanup/dirsize.json").expanduser()
+
+
+def _walk_sizes(path):
+    """Yield the size of every regular file under path without following symlinks"""
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_symlink():
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from _walk_sizes(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+
+def _run_discarding_output(cmd, timeout):
+    """Run a cleanup command, keeping only its stderr for error reporting"""
+    return subprocess.run(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=timeout
+    )
+
+
+def _rmtree_measuring(path):
+    """Delete a directory tree and return the freed space in MB"""
+    # Like shutil.rmtree, refuse a symlinked root (os.walk would follow it
+    # and empty the link's target) and anything that is not a directory
+    try:
+        if not stat.S_ISDIR(os.lstat(path).st_mode):
+            return 0
+    except OSError:
+        return 0
+    
+    total = 0
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            file_path = os.path.join(root, name)
+            try:
+                size = os.lstat(file_path).st_size
+                os.unlink(file_path)
+                total += size
+            except OSError:
+                pass
+        for name in dirs:
+            dir_path = os.path.join(root, name)
+            try:
+                if os.path.islink(dir_path):
+                    os.unlink(dir_path)
+                else:
+                    os.rmdir(dir_path)
+            except OSError:
+                pass
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+    return round(total / (1024 * 1024), 2)
+
 
 class SystemCacheCleaner:
     """Cleans system and application caches"""
@@ -18,18 +92,63 @@ class SystemCacheCleaner:
         self.config = config
         self.dry_run = config['safety']['dry_run']
         self.enabled_cleanups = config.get('cache_cleanup', {}).get('enabled', [])
+        # Dry-run size estimates keyed by path -> [top-level mtime_ns, size in MB]
+        self._size_cache = self._load_size_cache() if self.dry_run else {}
+        self._size_cache_dirty = False
+    
+    def _load_size_cache(self):
+        """Load remembered directory sizes from previous dry runs"""
+        try:
+            with open(DIR_SIZE_CACHE_FILE, 'r') as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_size_cache(self):
+        """Persist directory sizes measured during this dry run"""
+        if not self._size_cache_dirty:
+            return
         
+        try:
+            DIR_SIZE_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(DIR_SIZE_CACHE_FILE, 'w') as f:
+                json.dump(self._size_cache, f, indent=2, sort_keys=True)
+            self._size_cache_dirty = False
+        except Exception as e:
+            logger.warning(f"Could not save directory size cache: {e}")
+    
     def get_dir_size(self, path):
-        """Calculate directory size in MB"""
+        """Calculate directory size in MB
+        
+        In dry-run mode the result is reused until the directory's own mtime
+        changes. That only notices entries added or removed at the top level,
+        which is good enough for an estimate; real cleanups always re-walk.
+        """
         try:
-            total = 0
-            for entry in Path(path).rglob('*'):
-                if entry.is_file():
-                    total += entry.stat().st_size
-            return round(total / (1024 * 1024), 2)
+            if not self.dry_run:
+                return round(sum(_walk_sizes(str(path))) / (1024 * 1024), 2)
+            
+            key = str(path)
+            mtime_ns = os.stat(key).st_mtime_ns
+            cached = self._size_cache.get(key)
+            if cached and cached[0] == mtime_ns:
+                return cached[1]
+            
+            size = round(sum(_walk_sizes(key)) / (1024 * 1024), 2)
+            self._size_cache[key] = [mtime_ns, size]
+            self._size_cache_dirty = True
+            return size
         except Exception:
             return 0
     
+    def _sizes_parallel(self, paths):
+        """Calculate sizes of independent directories concurrently, in MB"""
+        if not paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(4, len(paths))) as executor:
+            return list(executor.map(self.get_dir_size, paths))
+    
     def clean_homebrew_cache(self):
         """Clean Homebrew cache"""
         if 'homebrew' not in self.enabled_cleanups:
@@ -41,13 +160,12 @@ class SystemCacheCleaner:
                 logger.info("Homebrew cache not found, skipping")
                 return 0
             
-            size_before = self.get_dir_size(cache_path)
-            
             if self.dry_run:
+                size_before = self.get_dir_size(cache_path)
                 logger.info(f"[DRY RUN] Would clean Homebrew cache (~{size_before} MB)")
                 return size_before
             
-            # Use brew cleanup command
+            # Use brew cleanup command; stdout is kept for its "freed" summary
             result = subprocess.run(
                 ['brew', 'cleanup', '-s'],
                 capture_output=True,
@@ -56,12 +174,15 @@ class SystemCacheCleaner:
             )
             
             if result.returncode == 0:
-                size_after = self.get_dir_size(cache_path)
-                freed = size_before - size_after
+                # brew reports how much it freed, so there is no need to re-walk the cache
+                freed = 0
+                match = BREW_FREED_RE.search(result.stdout)
+                if match:
+                    freed = round(float(match.group(1)) * UNIT_TO_MB[match.group(2)], 2)
                 logger.info(f"Cleaned Homebrew cache: freed {freed} MB")
                 return freed
             else:
-                logger.warning(f"Homebrew cleanup failed: {result.stderr}")
+                logger.warning(f"Homebrew cleanup failed: {result.stderr[-STDERR_LOG_LIMIT:]}")
                 return 0
                 
         except Exception as e:
@@ -79,21 +200,18 @@ class SystemCacheCleaner:
                 Path.home() / "Library/Caches/com.microsoft.VSCode",
             ]
             
+            cache_paths = [p for p in cache_paths if p.exists()]
             total_freed = 0
             
-            for cache_path in cache_paths:
-                if not cache_path.exists():
-                    continue
-                
-                size_before = self.get_dir_size(cache_path)
-                
-                if self.dry_run:
+            if self.dry_run:
+                for cache_path, size_before in zip(cache_paths, self._sizes_parallel(cache_paths)):
                     logger.info(f"[DRY RUN] Would clean {cache_path.name} (~{size_before} MB)")
                     total_freed += size_before
-                else:
-                    shutil.rmtree(cache_path, ignore_errors=True)
-                    logger.info(f"Cleaned {cache_path.name}: freed {size_before} MB")
-                    total_freed += size_before
+            else:
+                for cache_path in cache_paths:
+                    freed = _rmtree_measuring(cache_path)
+                    logger.info(f"Cleaned {cache_path.name}: freed {freed} MB")
+                    total_freed += freed
             
             return total_freed
             
@@ -118,18 +236,13 @@ class SystemCacheCleaner:
                 logger.info(f"[DRY RUN] Would clean pip cache (~{size_before} MB)")
                 return size_before
             
-            result = subprocess.run(
-                ['pip3', 'cache', 'purge'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            result = _run_discarding_output(['pip3', 'cache', 'purge'], timeout=30)
             
             if result.returncode == 0:
                 logger.info(f"Cleaned pip cache: freed {size_before} MB")
                 return size_before
             else:
-                logger.warning(f"Pip cache cleanup failed: {result.stderr}")
+                logger.warning(f"Pip cache cleanup failed: {result.stderr[-STDERR_LOG_LIMIT:]}")
                 return 0
                 
         except Exception as e:
@@ -143,13 +256,7 @@ class SystemCacheCleaner:
         
         try:
             # Check if npm is installed
-            npm_check = subprocess.run(
-                ['which', 'npm'],
-                capture_output=True,
-                text=True
-            )
-            
-            if npm_check.returncode != 0:
+            if shutil.which('npm') is None:
                 logger.info("npm not found, skipping")
                 return 0
             
@@ -163,18 +270,13 @@ class SystemCacheCleaner:
                 logger.info(f"[DRY RUN] Would clean npm cache (~{size_before} MB)")
                 return size_before
             
-            result = subprocess.run(
-                ['npm', 'cache', 'clean', '--force'],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            result = _run_discarding_output(['npm', 'cache', 'clean', '--force'], timeout=30)
             
             if result.returncode == 0:
                 logger.info(f"Cleaned npm cache: freed {size_before} MB")
                 return size_before
             else:
-                logger.warning(f"npm cache cleanup failed: {result.stderr}")
+                logger.warning(f"npm cache cleanup failed: {result.stderr[-STDERR_LOG_LIMIT:]}")
                 return 0
                 
         except Exception as e:
@@ -202,15 +304,14 @@ class SystemCacheCleaner:
                 continue
             
             try:
-                size_before = self.get_dir_size(cache_path)
-                
                 if self.dry_run:
+                    size_before = self.get_dir_size(cache_path)
                     logger.info(f"[DRY RUN] Would clean {cache_name} (~{size_before} MB)")
                     total_freed += size_before
                 else:
-                    shutil.rmtree(cache_path, ignore_errors=True)
-                    logger.info(f"Cleaned {cache_name}: freed {size_before} MB")
-                    total_freed += size_before
+                    freed = _rmtree_measuring(cache_path)
+                    logger.info(f"Cleaned {cache_name}: freed {freed} MB")
+                    total_freed += freed
                     
             except Exception as e:
                 logger.error(f"Error cleaning {cache_name}: {e}")
@@ -229,21 +330,18 @@ class SystemCacheCleaner:
                 Path.home() / "Library/Application Support/Google/Chrome/Default/Code Cache",
             ]
             
+            chrome_caches = [p for p in chrome_caches if p.exists()]
             total_freed = 0
             
-            for cache_path in chrome_caches:
-                if not cache_path.exists():
-                    continue
-                
-                size_before = self.get_dir_size(cache_path)
-                
-                if self.dry_run:
+            if self.dry_run:
+                for cache_path, size_before in zip(chrome_caches, self._sizes_parallel(chrome_caches)):
                     logger.info(f"[DRY RUN] Would clean Chrome {cache_path.name} (~{size_before} MB)")
                     total_freed += size_before
-                else:
-                    shutil.rmtree(cache_path, ignore_errors=True)
-                    logger.info(f"Cleaned Chrome {cache_path.name}: freed {size_before} MB")
-                    total_freed += size_before
+            else:
+                for cache_path in chrome_caches:
+                    freed = _rmtree_measuring(cache_path)
+                    logger.info(f"Cleaned Chrome {cache_path.name}: freed {freed} MB")
+                    total_freed += freed
             
             if total_freed > 0 and not self.dry_run:
                 logger.warning("Note: Chrome may need to be restarted for best performance")
@@ -266,14 +364,10 @@ class SystemCacheCleaner:
                 Path.home() / "Library/Safari/Databases",
             ]
             
+            safari_caches = [p for p in safari_caches if p.exists()]
             total_freed = 0
             
-            for cache_path in safari_caches:
-                if not cache_path.exists():
-                    continue
-                
-                size_before = self.get_dir_size(cache_path)
-                
+            for cache_path, size_before in zip(safari_caches, self._sizes_parallel(safari_caches)):
                 if self.dry_run:
                     logger.info(f"[DRY RUN] Would clean Safari {cache_path.name} (~{size_before} MB)")
                     total_freed += size_before
@@ -314,15 +408,14 @@ class SystemCacheCleaner:
                 
                 cache_path = profile / "cache2"
                 if cache_path.exists():
-                    size_before = self.get_dir_size(cache_path)
-                    
                     if self.dry_run:
+                        size_before = self.get_dir_size(cache_path)
                         logger.info(f"[DRY RUN] Would clean Firefox cache (~{size_before} MB)")
                         total_freed += size_before
                     else:
-                        shutil.rmtree(cache_path, ignore_errors=True)
-                        logger.info(f"Cleaned Firefox cache: freed {size_before} MB")
-                        total_freed += size_before
+                        freed = _rmtree_measuring(cache_path)
+                        logger.info(f"Cleaned Firefox cache: freed {freed} MB")
+                        total_freed += freed
             
             if total_freed > 0 and not self.dry_run:
                 logger.warning("Note: Firefox may need to be restarted")
@@ -357,16 +450,20 @@ class SystemCacheCleaner:
             ("User Caches", self.clean_user_caches),
         ]
         
-        for name, cleanup_func in cleanups:
-            try:
-                freed = cleanup_func()
-                total_freed += freed
-            except Exception as e:
-                logger.error(f"Error in {name} cleanup: {e}")
+        # Cleanups touch disjoint directories and mostly wait on subprocesses or
+        # disk I/O, so they can safely run side by side
+        with ThreadPoolExecutor(max_workers=len(cleanups)) as executor:
+            futures = {executor.submit(cleanup_func): name for name, cleanup_func in cleanups}
+            for future in as_completed(futures):
+                try:
+                    total_freed += future.result()
+                except Exception as e:
+                    logger.error(f"Error in {futures[future]} cleanup: {e}")
         
         logger.info("=" * 60)
         if self.dry_run:
             logger.info(f"Cache Cleanup Complete (DRY RUN): Would free ~{total_freed:.2f} MB")
+            self._save_size_cache()
         else:
             logger.info(f"Cache Cleanup Complete: Freed {total_freed:.2f} MB")
         logger.info("=" * 60)
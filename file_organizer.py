@@ -3,13 +3,21 @@ File Organizer Module
 Handles file organization by year and type
 """
 import os
+import re
+import json
+import itertools
 import shutil
+import stat
+import time
 from pathlib import Path
-from datetime import datetime
 import logging
 
+from ollama_classifier import is_trivial_name
+
 logger = logging.getLogger(__name__)
 
+OLLAMA_CACHE_FILE = Path("~/.cache/mac-cleanup/ollama_ext_cache.json").expanduser()
+
 
 class FileOrganizer:
     """Organizes files by year and type"""
@@ -19,83 +27,185 @@ class FileOrganizer:
         self.base_path = Path(config['organization']['base_path']).expanduser()
         self.misc_folder = config['organization']['misc_folder']
         self.file_types = config['file_types']
+        # Flattened extension -> category lookup; the first category listing an extension wins
+        self._ext_map = {}
+        for category, extensions in self.file_types.items():
+            for ext in extensions:
+                self._ext_map.setdefault(ext.lower(), category)
+        self._known_exts = frozenset(self._ext_map)
         self.dry_run = config['safety']['dry_run']
         self.min_age_days = config['safety']['min_age_days']
         self.exclude_patterns = config['safety']['exclude_patterns']
+        # Single alternation so each file is matched with one C-level search;
+        # (?!) never matches when no patterns are configured
+        self._excl_re = re.compile('|'.join(re.escape(p) for p in self.exclude_patterns) or r'(?!)')
         
-    def get_file_type(self, file_path):
-        """Determine file type based on extension"""
-        ext = file_path.suffix.lower()
-        
-        for category, extensions in self.file_types.items():
-            if ext in extensions:
-                return category
+        # Ollama classifications by extension, persisted across runs per model
+        self._ollama_model = config.get('ollama', {}).get('model', '')
+        self._ollama_cache = self._load_ollama_cache()
+        self._ollama_cache_dirty = False
+        self._ollama_parallel = max(1, config.get('ollama', {}).get('parallel', 4))
+        self._ollama_batch_size = config.get('ollama', {}).get('batch_size', 1)
+        self._dest_devices = {}  # dest_dir -> st_dev, for directories already created
+    
+    def _load_ollama_cache(self):
+        """Load cached Ollama classifications for the configured model"""
+        try:
+            with open(OLLAMA_CACHE_FILE, 'r') as f:
+                cached = json.load(f).get(self._ollama_model, {})
+        except (OSError, ValueError, AttributeError):
+            return {}
         
-        return self.misc_folder
+        # Drop entries for categories that no longer exist in the config
+        valid = set(self.file_types) | {self.misc_folder}
+        return {ext: category for ext, category in cached.items() if category in valid}
     
-    def get_file_year(self, file_path):
-        """Get the year when the file was created/modified"""
+    def _save_ollama_cache(self):
+        """Persist Ollama classifications if anything new was learned"""
+        if not self._ollama_cache_dirty:
+            return
+        
         try:
-            # Try creation time first, fall back to modification time
-            stat = file_path.stat()
-            timestamp = getattr(stat, 'st_birthtime', stat.st_mtime)
-            return datetime.fromtimestamp(timestamp).year
+            try:
+                with open(OLLAMA_CACHE_FILE, 'r') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    data = {}
+            except (OSError, ValueError):
+                data = {}
+            
+            data[self._ollama_model] = self._ollama_cache
+            OLLAMA_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(OLLAMA_CACHE_FILE, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            self._ollama_cache_dirty = False
         except Exception as e:
-            logger.warning(f"Could not get date for {file_path}: {e}")
-            return datetime.now().year
+            logger.warning(f"Could not save Ollama classification cache: {e}")
+    
+    def classify_with_ollama(self, file_paths, ollama_classifier):
+        """Classify files with Ollama, sending one request per uncached extension
+        
+        Returns a dict mapping each file path to its category (or None).
+        """
+        results = {}
+        pending = {}  # request key -> files waiting on that request
+        
+        for file_path in file_paths:
+            key = file_path.suffix.lower()
+            if key in self._ollama_cache:
+                results[file_path] = self._ollama_cache[key]
+            elif is_trivial_name(file_path):
+                # Decided by the name alone, so it says nothing about the extension
+                results[file_path] = self.misc_folder
+            else:
+                pending.setdefault(key, []).append(file_path)
+        
+        if pending:
+            representatives = [paths[0] for paths in pending.values()]
+            if self._ollama_batch_size > 1:
+                file_types = ollama_classifier.classify_batch(representatives, k=self._ollama_batch_size)
+            else:
+                file_types = ollama_classifier.classify_files(representatives, concurrency=self._ollama_parallel)
+            
+            for (key, paths), file_type in zip(pending.items(), file_types):
+                for file_path in paths:
+                    results[file_path] = file_type
+                if file_type is not None:
+                    self._ollama_cache[key] = file_type
+                    self._ollama_cache_dirty = True
+        
+        return results
+        
+    def get_file_type(self, file_path):
+        """Determine file type based on extension"""
+        return self._ext_map.get(file_path.suffix.lower(), self.misc_folder)
     
-    def should_skip_file(self, file_path):
+    def get_file_year(self, file_stat):
+        """Get the year when the file was created/modified, from its stat result"""
+        # Try creation time first, fall back to modification time
+        timestamp = getattr(file_stat, 'st_birthtime', file_stat.st_mtime)
+        return time.localtime(timestamp).tm_year
+    
+    def should_skip_file(self, file_path, now_ts=None, file_stat=None):
         """Check if file should be skipped"""
         # Check exclude patterns
-        for pattern in self.exclude_patterns:
-            if pattern in str(file_path):
-                return True
+        if self._excl_re.search(str(file_path)):
+            return True
         
         # Check minimum age
         if self.min_age_days > 0:
+            if now_ts is None:
+                now_ts = time.time()
             try:
-                stat = file_path.stat()
-                age_days = (datetime.now().timestamp() - stat.st_mtime) / 86400
-                if age_days < self.min_age_days:
+                file_stat = file_stat or file_path.stat()
+                if (now_ts - file_stat.st_mtime) < self.min_age_days * 86400:
                     return True
             except Exception:
                 pass
         
         return False
     
-    def organize_file(self, file_path, file_type_override=None):
+    def _dest_candidates(self, dest_dir, name):
+        """Yield name, then name_1, name_2, ... inside dest_dir"""
+        original = dest_dir / name
+        yield original
+        for counter in itertools.count(1):
+            yield dest_dir / f"{original.stem}_{counter}{original.suffix}"
+    
+    def _reserve_dest(self, dest_dir, name):
+        """Atomically claim a free destination path by creating an empty placeholder"""
+        for candidate in self._dest_candidates(dest_dir, name):
+            try:
+                fd = os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            return candidate
+    
+    def organize_file(self, file_path, file_type_override=None, now_ts=None, file_stat=None):
         """Organize a single file"""
         try:
-            if not file_path.is_file():
-                return False
+            # Callers that already hold a stat result (e.g. from os.scandir)
+            # have established this is a regular file
+            if file_stat is None:
+                if not file_path.is_file():
+                    return False
+                file_stat = file_path.stat()
             
-            if self.should_skip_file(file_path):
+            if self.should_skip_file(file_path, now_ts, file_stat):
                 logger.debug(f"Skipping {file_path.name}")
                 return False
             
             # Determine file type and year
             file_type = file_type_override or self.get_file_type(file_path)
-            year = self.get_file_year(file_path)
+            year = self.get_file_year(file_stat)
             
             # Create destination path: base_path/year/type/filename
             dest_dir = self.base_path / str(year) / file_type
-            dest_path = dest_dir / file_path.name
-            
-            # Handle duplicate filenames
-            counter = 1
-            original_dest = dest_path
-            while dest_path.exists():
-                stem = original_dest.stem
-                suffix = original_dest.suffix
-                dest_path = dest_dir / f"{stem}_{counter}{suffix}"
-                counter += 1
             
-            # Create directory and move file
+            # Create directory and move file, renaming on duplicate filenames
             if self.dry_run:
+                dest_path = next(p for p in self._dest_candidates(dest_dir, file_path.name) if not p.exists())
                 logger.info(f"[DRY RUN] Would move: {file_path} -> {dest_path}")
             else:
-                dest_dir.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(file_path), str(dest_path))
+                # Files share a handful of year/type folders, so only create each once
+                dest_dev = self._dest_devices.get(dest_dir)
+                if dest_dev is None:
+                    dest_dir.mkdir(parents=True, exist_ok=True)
+                    dest_dev = self._dest_devices[dest_dir] = os.stat(dest_dir).st_dev
+                dest_path = self._reserve_dest(dest_dir, file_path.name)
+                try:
+                    # Moving over our own placeholder replaces it; a plain rename
+                    # is enough unless the file has to cross filesystems
+                    if file_stat.st_dev == dest_dev:
+                        os.replace(file_path, dest_path)
+                    else:
+                        shutil.move(str(file_path), str(dest_path))
+                except BaseException:
+                    # Including Ctrl-C mid-copy, which would otherwise leave
+                    # an empty or partial file at the destination
+                    dest_path.unlink(missing_ok=True)
+                    raise
                 logger.info(f"Moved: {file_path.name} -> {year}/{file_type}/")
             
             return True
@@ -116,33 +226,107 @@ class FileOrganizer:
         organized_count = 0
         
         try:
-            files = [f for f in folder.iterdir() if f.is_file()]
+            # DirEntry caches the file type from readdir, so this costs one
+            # stat per file which is then reused for the skip and year checks
+            entries = []
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        # Files can vanish after readdir, e.g. a browser renaming a finished .crdownload
+                        entries.append((entry.path, entry.stat()))
+                    except OSError:
+                        continue
             
-            for file_path in files:
-                # Use Ollama for intelligent classification if available
-                file_type = None
-                if ollama_classifier and file_path.suffix.lower() not in [ext for exts in self.file_types.values() for ext in exts]:
-                    file_type = ollama_classifier.classify_file(file_path)
-                
-                if self.organize_file(file_path, file_type):
-                    organized_count += 1
+            organized_count = self._organize_entries(entries, ollama_classifier)
+            logger.info(f"Organized {organized_count} files from {folder}")
+            
+        except Exception as e:
+            logger.error(f"Error organizing folder {folder}: {e}")
+        
+        self._save_ollama_cache()
+        return organized_count
+    
+    def organize_folder_recursive(self, folder_path, ollama_classifier=None):
+        """Organize all files in a folder and its subfolders"""
+        folder = Path(folder_path).expanduser()
+        
+        if not folder.exists():
+            logger.warning(f"Folder does not exist: {folder}")
+            return 0
+        
+        logger.info(f"Organizing folder recursively: {folder}")
+        organized_count = 0
+        base_path = str(self.base_path)
+        
+        try:
+            entries = []
+            for root, dirnames, filenames in os.walk(folder):
+                # Prune excluded directories, the organized tree itself, hidden
+                # directories (.venv, .idea, .Trash, ...) and any directory with an
+                # extension before os.walk descends into them. The latter are macOS
+                # bundles and packages (Foo.app, .photoslibrary, .xcodeproj, package
+                # .pages/.key/.numbers); their contents, like tool state, must stay together
+                dirnames[:] = [
+                    d for d in dirnames
+                    if not self._excl_re.search(d)
+                    and not d.startswith('.')
+                    and not os.path.splitext(d)[1]
+                    and os.path.join(root, d) != base_path
+                ]
+                for name in filenames:
+                    entry_path = os.path.join(root, name)
+                    try:
+                        file_stat = os.lstat(entry_path)
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(file_stat.st_mode):
+                        entries.append((entry_path, file_stat))
             
+            organized_count = self._organize_entries(entries, ollama_classifier)
             logger.info(f"Organized {organized_count} files from {folder}")
             
         except Exception as e:
             logger.error(f"Error organizing folder {folder}: {e}")
         
+        self._save_ollama_cache()
+        return organized_count
+    
+    def _organize_entries(self, entries, ollama_classifier=None):
+        """Organize (path, stat_result) pairs gathered from a folder scan"""
+        now_ts = time.time()
+        files = [(Path(entry_path), file_stat) for entry_path, file_stat in entries]
+        
+        # Use Ollama for intelligent classification if available, for every
+        # unknown extension up front so the requests can run concurrently
+        ollama_types = {}
+        if ollama_classifier:
+            unknown = [
+                file_path for file_path, file_stat in files
+                if file_path.suffix.lower() not in self._known_exts
+                and not self.should_skip_file(file_path, now_ts, file_stat)
+            ]
+            ollama_types = self.classify_with_ollama(unknown, ollama_classifier)
+        
+        organized_count = 0
+        for file_path, file_stat in files:
+            file_type = ollama_types.get(file_path)
+            if self.organize_file(file_path, file_type, now_ts, file_stat):
+                organized_count += 1
+        
         return organized_count
     
-    def organize_all(self, ollama_classifier=None):
+    def organize_all(self, ollama_classifier=None, recursive=False):
         """Organize all configured folders"""
         total = 0
         folders = self.config['folders']
+        organize = self.organize_folder_recursive if recursive else self.organize_folder
         
         logger.info(f"Starting organization of {len(folders)} folders")
         
         for folder in folders:
-            count = self.organize_folder(folder, ollama_classifier)
+            count = organize(folder, ollama_classifier)
             total += count
         
         logger.info(f"Total files organized: {total}")
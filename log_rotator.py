@@ -3,7 +3,7 @@ Log Rotation Module
 Manages log files and deletes logs older than specified days
 """
 import os
-import glob
+import fnmatch
 from pathlib import Path
 from datetime import datetime, timedelta
 import logging
@@ -28,8 +28,22 @@ class LogRotator:
         self.log_ext = self.log_file.suffix
         self.retention_days = retention_days
     
+    def _scan_logs(self, pattern):
+        """Return (DirEntry, stat_result) pairs for log files matching pattern"""
+        with os.scandir(self.log_dir) as it:
+            return [
+                (entry, entry.stat())
+                for entry in it
+                if fnmatch.fnmatchcase(entry.name, pattern) and entry.is_file()
+            ]
+    
     def rotate_log(self):
-        """Rotate the current log file with timestamp"""
+        """
+        Rotate the current log file with timestamp
+        
+        The log is renamed rather than copied, so call this before a logging
+        handler opens the file; an open handler would keep writing to the backup.
+        """
         if not self.log_file.exists():
             return
         
@@ -46,13 +60,9 @@ class LogRotator:
         backup_path = self.log_dir / backup_name
         
         try:
-            # Copy to backup
-            import shutil
-            shutil.copy2(self.log_file, backup_path)
-            
-            # Clear original file
-            with open(self.log_file, 'w') as f:
-                f.write('')
+            # Move the current log aside (no data copy) and start a fresh one
+            os.rename(self.log_file, backup_path)
+            open(self.log_file, 'w').close()
             
             logger.info(f"Log rotated to: {backup_name}")
             
@@ -64,29 +74,25 @@ class LogRotator:
         if not self.log_dir.exists():
             return
         
-        # Calculate cutoff date
-        cutoff_date = datetime.now() - timedelta(days=self.retention_days)
+        # Calculate cutoff as a timestamp so it compares directly with st_mtime
+        cutoff_ts = (datetime.now() - timedelta(days=self.retention_days)).timestamp()
         deleted_count = 0
         
         try:
             # Find all log files with timestamp pattern
             pattern = f"{self.log_name}_*{self.log_ext}"
-            log_files = glob.glob(str(self.log_dir / pattern))
+            log_files = self._scan_logs(pattern)
             
-            for log_path in log_files:
+            for entry, file_stat in log_files:
                 try:
-                    # Get file modification time
-                    file_stat = os.stat(log_path)
-                    file_date = datetime.fromtimestamp(file_stat.st_mtime)
-                    
                     # Delete if older than retention period
-                    if file_date < cutoff_date:
-                        os.remove(log_path)
+                    if file_stat.st_mtime < cutoff_ts:
+                        os.remove(entry.path)
                         deleted_count += 1
-                        logger.info(f"Deleted old log: {Path(log_path).name}")
+                        logger.info(f"Deleted old log: {entry.name}")
                         
                 except Exception as e:
-                    logger.error(f"Error processing {log_path}: {e}")
+                    logger.error(f"Error processing {entry.path}: {e}")
             
             if deleted_count > 0:
                 logger.info(f"Cleaned up {deleted_count} old log file(s)")
@@ -100,9 +106,9 @@ class LogRotator:
         """Get statistics about log files"""
         try:
             pattern = f"{self.log_name}*{self.log_ext}"
-            log_files = glob.glob(str(self.log_dir / pattern))
+            log_files = self._scan_logs(pattern)
             
-            total_size = sum(os.path.getsize(f) for f in log_files)
+            total_size = sum(file_stat.st_size for _, file_stat in log_files)
             total_size_mb = total_size / (1024 * 1024)
             
             return {
@@ -6,17 +6,29 @@ Uses Ollama for intelligent file classification
 """
 import os
 import sys
+import copy
 import logging
 import argparse
 from pathlib import Path
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 from file_organizer import FileOrganizer
 from ollama_classifier import OllamaClassifier
 from log_rotator import LogRotator
 from cache_cleaner import SystemCacheCleaner
 
 
+CONSOLE_FORMAT = logging.Formatter('%(levelname)s: %(message)s')
+FILE_FORMAT = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+_config_cache = {}  # resolved path -> (mtime_ns, config)
+
+
 def load_config(config_path='config.yaml'):
     """Load configuration from YAML file"""
     try:
@@ -25,9 +37,16 @@ def load_config(config_path='config.yaml'):
         if local_config.exists():
             config_path = local_config
         
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        return config
+        # Reuse the parsed config until the file changes; hand out a copy so
+        # callers can override settings without touching the cached one
+        key = str(Path(config_path).resolve())
+        mtime_ns = os.stat(key).st_mtime_ns
+        cached = _config_cache.get(key)
+        if cached is None or cached[0] != mtime_ns:
+            with open(config_path, 'r') as f:
+                config = yaml.load(f, Loader=SafeLoader)
+            cached = _config_cache[key] = (mtime_ns, config)
+        return copy.deepcopy(cached[1])
     except Exception as e:
         print(f"Error loading config: {e}")
         sys.exit(1)
@@ -45,20 +64,34 @@ def setup_logging(config):
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(getattr(logging, log_level))
-    console_format = logging.Formatter('%(levelname)s: %(message)s')
-    console_handler.setFormatter(console_format)
+    console_handler.setFormatter(CONSOLE_FORMAT)
     logger.addHandler(console_handler)
     
-    # File handler
-    file_handler = logging.FileHandler(log_file)
+    # File handler (opened lazily on the first record)
+    file_handler = logging.FileHandler(log_file, delay=True)
     file_handler.setLevel(logging.DEBUG)
-    file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_format)
+    file_handler.setFormatter(FILE_FORMAT)
     logger.addHandler(file_handler)
     
     return logger
 
 
+def probe_models(config, models, logger):
+    """Report each candidate model's accuracy on the canned classification eval set"""
+    for model in models:
+        model_config = copy.deepcopy(config)
+        model_config['ollama']['model'] = model
+        classifier = OllamaClassifier(model_config)
+        if not classifier.is_available():
+            logger.warning(f"Skipping {model}: Ollama not available")
+            continue
+        
+        correct, answered, skipped, seconds = classifier.probe()
+        logger.info(f"{model}: {correct}/{answered} correct ({correct / max(answered, 1):.0%}) in {seconds:.1f}s")
+        if skipped:
+            logger.warning(f"{model}: {skipped} sample(s) not scored because requests failed")
+
+
 def main():
     """Main entry point"""
     parser = argparse.ArgumentParser(
@@ -83,6 +116,17 @@ def main():
         '--folder',
         help='Organize specific folder instead of all configured folders'
     )
+    parser.add_argument(
+        '--recursive',
+        action='store_true',
+        help='Also organize files inside subfolders (excluded, hidden and bundle folders such as .app are skipped)'
+    )
+    parser.add_argument(
+        '--probe-model',
+        nargs='+',
+        metavar='MODEL',
+        help='Measure classification accuracy of one or more Ollama models and exit'
+    )
     parser.add_argument(
         '--skip-cache-cleanup',
         action='store_true',
@@ -119,6 +163,11 @@ def main():
     logger.info("=" * 60)
     logger.debug(f"Log files: {log_stats['count']}, Total size: {log_stats['total_size_mb']} MB")
     
+    # Compare candidate models instead of cleaning up
+    if args.probe_model:
+        probe_models(config, args.probe_model, logger)
+        sys.exit(0)
+    
     if config['safety']['dry_run']:
         logger.warning("DRY RUN MODE - No files will be moved")
     
@@ -151,10 +200,13 @@ def main():
     try:
         if args.folder:
             # Organize specific folder
-            count = organizer.organize_folder(args.folder, ollama_classifier)
+            if args.recursive:
+                count = organizer.organize_folder_recursive(args.folder, ollama_classifier)
+            else:
+                count = organizer.organize_folder(args.folder, ollama_classifier)
         else:
             # Organize all configured folders
-            count = organizer.organize_all(ollama_classifier)
+            count = organizer.organize_all(ollama_classifier, recursive=args.recursive)
         
         logger.info("=" * 60)
         if config['safety']['dry_run']:
@@ -163,6 +215,9 @@ def main():
             logger.info(f"CLEANUP COMPLETE - Organized {count} files")
         logger.info("=" * 60)
         
+        if ollama_classifier:
+            logger.debug(f"Ollama latency (ms): {ollama_classifier.metrics_summary()}")
+        
     except KeyboardInterrupt:
         logger.info("Cleanup interrupted by user")
         sys.exit(0)
@@ -2,16 +2,120 @@
 Ollama Classifier Module
 Uses Ollama to intelligently classify files with unknown types
 """
+import re
+import math
+import time
+import asyncio
+import itertools
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque, namedtuple
 from pathlib import Path
 
 try:
     import ollama
+    import httpx  # Installed with ollama
 except ImportError:
     ollama = None
 
+try:
+    import orjson as fast_json  # Several times faster on Ollama's responses
+except ImportError:
+    import json as fast_json
+
 logger = logging.getLogger(__name__)
 
+CACHE_DB_FILE = Path("~/.cache/mac-cleanup/ollama_classifier.db").expanduser()
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+# Timing fields Ollama reports with each generate reply (durations in nanoseconds)
+LatencyBreakdown = namedtuple('LatencyBreakdown', [
+    'total_duration', 'load_duration', 'prompt_eval_count',
+    'prompt_eval_duration', 'eval_count', 'eval_duration',
+])
+METRICS_WINDOW = 256  # Generate replies kept for metrics_summary()
+WAVE_ROUNDS = 4  # classify_files re-tunes concurrency after this many requests per slot
+BATCH_NUM_CTX = 1024  # Context for classify_batch prompts (instructions plus up to ~16 files)
+SLOWDOWN = 1.5  # Per-token decode slowdown over the first wave that halves concurrency
+DIGITS_RE = re.compile(r'\d+')
+AVAILABILITY_TTL = 15.0  # Seconds an is_available() answer is reused
+FAIL_THRESHOLD = 3  # Consecutive request failures before the circuit breaker opens
+COOLDOWN = 30.0  # Seconds to stop calling Ollama once the breaker is open
+QUARANTINE = 30.0  # Seconds a failing ollama.endpoints entry is skipped
+JSON_HEADERS = {'Content-Type': 'application/json'}
+SEPARATORS_RE = re.compile(r'[\s_\-.]+')
+BATCH_LINE_RE = re.compile(r'^\s*(\d+)[:.)]\s*(\w+)', re.M)
+# Names not worth a model call: temporary/partial downloads, dotfiles and
+# extensionless files, hash-like stems and overlong (likely encoded) names
+TRIVIAL_EXTS = frozenset({'.tmp', '.part', '.crdownload', '.ds_store', '.lock', ''})
+# Hex of 8+ characters mixing digits and letters, so dates (20240101) and
+# words spelled with a-f (facade) are not mistaken for hashes
+HASH_STEM_RE = re.compile(r'(?=[0-9a-f]*[0-9])(?=[0-9a-f]*[a-f])[0-9a-f]{8,}')
+MAX_NAME_LENGTH = 200
+SMALL_MODEL = 'qwen2.5:0.5b-instruct-q4_K_M'  # Picking one of ~10 labels needs no large model
+LARGE_MODEL_PARAMS = 3.0  # Billions of parameters above which init warns
+MODEL_SIZE_RE = re.compile(r'[:\-](\d+(?:\.\d+)?)b\b')
+
+# Canned eval set for --probe-model: names whose extensions are not in the
+# default config, so every answer comes from the model
+PROBE_FILES = [
+    ('vacation.heif', 'images'), ('IMG_2041.tiff', 'images'), ('favicon.ico', 'images'),
+    ('scan_0003.tif', 'images'), ('DSC_0112.nef', 'images'), ('avatar.jfif', 'images'),
+    ('sunset.raw', 'images'),
+    ('resume.pages', 'documents'), ('thesis.tex', 'documents'), ('README.rst', 'documents'),
+    ('novel.epub', 'documents'), ('letter.wpd', 'documents'), ('report.xps', 'documents'),
+    ('budget.numbers', 'spreadsheets'), ('sales_q3.tsv', 'spreadsheets'), ('payroll.xlsm', 'spreadsheets'),
+    ('forecast.xlsb', 'spreadsheets'), ('inventory.fods', 'spreadsheets'),
+    ('pitch.odp', 'presentations'), ('deck.pps', 'presentations'), ('slides.ppsx', 'presentations'),
+    ('lecture_template.potx', 'presentations'),
+    ('clip.m4v', 'videos'), ('movie.wmv', 'videos'), ('recording.3gp', 'videos'),
+    ('screen_capture.mpeg', 'videos'), ('trailer.ogv', 'videos'),
+    ('song.ogg', 'audio'), ('podcast_ep12.opus', 'audio'), ('voice_memo.aiff', 'audio'),
+    ('track01.wma', 'audio'), ('ringtone.m4r', 'audio'),
+    ('backup.bz2', 'archives'), ('bundle.xz', 'archives'), ('sources.tgz', 'archives'),
+    ('old_files.zst', 'archives'), ('data.lz', 'archives'),
+    ('deploy.sh', 'code'), ('main.go', 'code'), ('app.rs', 'code'), ('index.ts', 'code'),
+    ('component.jsx', 'code'), ('query.sql', 'code'), ('helpers.rb', 'code'), ('style.scss', 'code'),
+    ('a1b2c3d4.tmp', 'misc'), ('file.crdownload', 'misc'), ('Installer.dmg', 'misc'),
+    ('Helvetica.ttf', 'misc'), ('cert.pem', 'misc'),
+]
+
+
+def stem_signature(file_path):
+    """Normalize a file stem so names differing only in numbers match (IMG_1234 -> img_#)"""
+    return DIGITS_RE.sub('#', file_path.stem.lower())
+
+
+def is_trivial_name(file_path):
+    """True for names whose category (misc) is obvious without a model"""
+    stem = file_path.stem
+    return (
+        file_path.suffix.lower() in TRIVIAL_EXTS
+        or not stem
+        or len(file_path.name) > MAX_NAME_LENGTH
+        or HASH_STEM_RE.fullmatch(stem.lower()) is not None
+    )
+
+
+def _category_code(index):
+    """Short answer code for the index-th category: a..z, then aa, ab, ..."""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    if index < len(letters):
+        return letters[index]
+    return letters[index // len(letters) - 1] + letters[index % len(letters)]
+
+
+def _percentile(values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    return values[round(q * (len(values) - 1))]
+
+
+def _normalize(vector):
+    """Scale a vector to unit length so dot products are cosine similarities"""
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
 
 class OllamaClassifier:
     """Uses Ollama to classify files intelligently"""
@@ -24,79 +128,751 @@ class OllamaClassifier:
         
         self.config = config
         self.enabled = True
-        self.model = config['ollama']['model']
-        self.temperature = config['ollama'].get('temperature', 0.3)
+        self.model = config['ollama'].get('model', SMALL_MODEL)
+        self.temperature = config['ollama'].get('temperature', 0.0)
         self.timeout = config['ollama'].get('timeout', 30)
         self.base_url = config['ollama'].get('base_url', 'http://localhost:11434')
         
+        # Greedy decoding in a small context: the prompt is well under 200
+        # tokens and none of the sampling features change a one-code answer.
+        # Any Ollama option can be overridden under ollama.options
+        self._options = {
+            'temperature': self.temperature,
+            'num_ctx': 256,
+            'num_batch': 32,
+            'repeat_penalty': 1.0,
+            'top_k': 1,
+            'top_p': 1.0,
+            'mirostat': 0,
+        }
+        self._options.update(config['ollama'].get('options') or {})
+        self._single_options = dict(
+            self._options,
+            num_predict=2,  # A category code is a single token
+            stop=['\n'],
+        )
+        
         # Categories from config
         self.categories = list(config['file_types'].keys()) + [config['organization']['misc_folder']]
+        # The model answers with a one-letter code per category, so decoding
+        # an answer takes a single step instead of one per token of the name
+        self._code_to_cat = {_category_code(i): c for i, c in enumerate(self.categories)}
+        self._cat_to_code = {c: code for code, c in self._code_to_cat.items()}
+        self._categories_str = ', '.join(f"{code}={c}" for code, c in self._code_to_cat.items())
+        misc_code = self._cat_to_code[self.categories[-1]]
+        # Lowercased name -> configured name, in case the model spells the category out
+        self._categories_by_lower = {c.lower(): c for c in self.categories}
+        # One pass over the reply: a bare code only when it is the whole reply
+        # (optionally after a "Category:"/"Code:" label), since codes like 'a'
+        # and 'i' are also words; otherwise the first category name anywhere,
+        # so answers like "Category: documents." still count
+        codes = '|'.join(re.escape(code) for code in self._code_to_cat)
+        names = '|'.join(re.escape(c) for c in sorted(self._categories_by_lower, key=len, reverse=True))
+        self._answer_re = re.compile(
+            rf'^\W*(?:(?:category|code)\s*[:=]?\s*)?({codes})\W*$|\b({names})\b',
+            re.IGNORECASE,
+        )
+        self._misc = config['organization']['misc_folder']
+        
+        # Tier 1: known extensions never need a model
+        self._ext_to_cat = {}
+        for category, extensions in config['file_types'].items():
+            for ext in extensions:
+                self._ext_to_cat.setdefault(ext.lower(), category)
+        
+        # Tier 2 (optional): nearest category by embedding similarity
+        self.embedding_model = config['ollama'].get('embedding_model')
+        self.embedding_threshold = config['ollama'].get('embedding_threshold', 0.55)
+        self._cat_vecs = None
+        self._embed_lock = threading.Lock()
+        
+        # Static instructions go first and the file details last, so every
+        # request shares a byte-identical prefix that Ollama can keep in its
+        # KV cache instead of re-processing it per file
+        self._prompt_prefix = f"""You are a file classification assistant. Classify the file below into ONE category.
+
+Available categories (code=name): {self._categories_str}
+
+Respond with ONLY the code of the category, nothing else. If uncertain, respond with '{misc_code}'.
+
+File:"""
+        self._batch_prompt_prefix = f"""You are a file classification assistant. Classify each of the files below into ONE category.
+
+Available categories (code=name): {self._categories_str}
+
+Respond with one line per file of the form `<number>: <code>`, nothing else. If uncertain, use '{misc_code}'.
+
+"""
+        
+        # LRU of (extension, stem signature) -> category; only valid answers are stored
+        self.cache_size = config['ollama'].get('cache_size', 4096)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        # Backed by sqlite so answers survive between runs
+        self._db = self._open_db()
+        
+        # (available, expires at) from the last probe or request; None forces a probe
+        self._avail_cached = None
+        
+        self._metrics = deque(maxlen=METRICS_WINDOW)
+        
+        # Optional fleet of OpenAI-compatible servers (Ollama workers or a
+        # litellm gateway) that classify_files round-robins between
+        self._endpoints = [url.rstrip('/') for url in config['ollama'].get('endpoints') or []]
+        self._endpoint_cycle = itertools.cycle(range(len(self._endpoints)))
+        self._endpoint_slots = max(1, config['ollama'].get('per_endpoint_slots', 1))
+        self._endpoint_sems = {}  # Created per event loop in _gather
+        self._quarantined_until = {}  # url -> monotonic time it may be used again
+        if self._endpoints and config['ollama'].get('batch_size', 1) > 1:
+            logger.warning(
+                "ollama.endpoints is ignored with batch_size > 1; packed requests go to %s",
+                self.base_url,
+            )
+        
+        # Circuit breaker so an unreachable server costs one timeout per
+        # FAIL_THRESHOLD files rather than one per file
+        self._fail_count = 0
+        self._open_until = 0.0
+        self._breaker_lock = threading.Lock()
         
         try:
-            # Initialize Ollama client
-            self.client = ollama.Client(host=self.base_url)
-            logger.info(f"Ollama classifier initialized with model: {self.model}")
+            # Initialize Ollama client with a keep-alive pool so every request
+            # reuses a warm connection instead of reconnecting
+            self.client = ollama.Client(
+                host=self.base_url,
+                timeout=self.timeout,
+                transport=httpx.HTTPTransport(retries=1, limits=self._http_limits()),
+            )
+            # Generate requests are posted directly over the client's pool
+            self._http = self.client._client
+            logger.info("Ollama classifier initialized with model: %s", self.model)
+            self._warn_if_large_model()
         except Exception as e:
-            logger.error(f"Failed to initialize Ollama client: {e}")
+            logger.error("Failed to initialize Ollama client: %s", e)
             self.enabled = False
     
+    def _warn_if_large_model(self):
+        """Suggest a small quantized model when the configured one is large"""
+        match = MODEL_SIZE_RE.search(self.model.lower())
+        if match and float(match.group(1)) > LARGE_MODEL_PARAMS:
+            logger.warning(
+                "%s is larger than needed; classification works well on small "
+                "quantized models, consider %s (compare with --probe-model)",
+                self.model, SMALL_MODEL,
+            )
+    
+    @staticmethod
+    def _http_limits():
+        return httpx.Limits(max_keepalive_connections=16, max_connections=32)
+    
+    def _breaker_open(self):
+        return time.monotonic() < self._open_until
+    
+    def _record_success(self):
+        # A request that went through proves the server is up
+        self._avail_cached = (True, time.monotonic() + AVAILABILITY_TTL)
+        with self._breaker_lock:
+            self._fail_count = 0
+    
+    def _record_failure(self, error):
+        if isinstance(error, (httpx.TransportError, ConnectionError)):
+            self._avail_cached = None
+        with self._breaker_lock:
+            self._fail_count += 1
+            if self._fail_count >= FAIL_THRESHOLD and not self._breaker_open():
+                self._open_until = time.monotonic() + COOLDOWN
+                logger.warning(
+                    "Ollama failed %d times in a row, skipping AI classification for %.0fs",
+                    self._fail_count, COOLDOWN,
+                )
+    
+    def _record_latency(self, response):
+        if 'eval_duration' in response:
+            self._metrics.append(LatencyBreakdown(*(response.get(f, 0) for f in LatencyBreakdown._fields)))
+    
+    def metrics_summary(self):
+        """p50/p95 in milliseconds of each timing component over recent generate calls"""
+        samples = list(self._metrics)
+        if not samples:
+            return {}
+        
+        summary = {}
+        for field in ('total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration'):
+            values = sorted(getattr(m, field) / 1e6 for m in samples)
+            summary[field] = {'p50': _percentile(values, 0.5), 'p95': _percentile(values, 0.95)}
+        return summary
+    
+    def _eval_per_token(self, last):
+        """Median decode nanoseconds per token over the last `last` generate calls"""
+        samples = list(self._metrics)[-last:]
+        values = sorted(m.eval_duration / m.eval_count for m in samples if m.eval_count)
+        return _percentile(values, 0.5) if values else None
+    
+    def cache_info(self):
+        """Report classification cache statistics, like functools.lru_cache"""
+        with self._cache_lock:
+            return CacheInfo(self._cache_hits, self._cache_misses, self.cache_size, len(self._cache))
+    
+    def _open_db(self):
+        """Open the persistent classification cache, or return None if unusable"""
+        try:
+            CACHE_DB_FILE.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(CACHE_DB_FILE, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, category TEXT, model TEXT, ts REAL)'
+            )
+            return db
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Could not open classification cache %s: %s", CACHE_DB_FILE, e)
+            return None
+    
+    def _db_key(self, key):
+        ext, signature = key
+        return f"{self.model}|{ext}|{signature}"
+    
+    def _db_get(self, key):
+        """Look a key up on disk; call with _cache_lock held"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute('SELECT category FROM cache WHERE key = ?', (self._db_key(key),)).fetchone()
+        except sqlite3.Error as e:
+            logger.debug("Classification cache lookup failed: %s", e)
+            return None
+        # Ignore answers for categories that have since been removed from the config
+        if row is None or row[0] not in self.categories:
+            return None
+        return row[0]
+    
+    def _cache_get(self, key):
+        with self._cache_lock:
+            category = self._cache.get(key)
+            if category is None:
+                category = self._db_get(key)
+                if category is None:
+                    self._cache_misses += 1
+                    return None
+                self._cache[key] = category
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+            return category
+    
+    def _cache_put(self, *items):
+        """Store (key, category) pairs in memory and on disk"""
+        with self._cache_lock:
+            for key, category in items:
+                self._cache[key] = category
+                self._cache.move_to_end(key)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            
+            if self._db is None:
+                return
+            now = time.time()
+            try:
+                self._db.execute('BEGIN')
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                    [(self._db_key(key), category, self.model, now) for key, category in items],
+                )
+                self._db.execute('COMMIT')
+            except sqlite3.Error as e:
+                logger.debug("Could not save classifications: %s", e)
+                if self._db.in_transaction:
+                    self._db.execute('ROLLBACK')
+    
+    def cache_invalidate(self, older_than=None):
+        """
+        Forget cached classifications for this model
+        
+        Args:
+            older_than: Only drop entries at least this many seconds old (default: all)
+        
+        Returns the number of entries removed from disk.
+        """
+        cutoff = time.time() - older_than if older_than is not None else float('inf')
+        with self._cache_lock:
+            self._cache.clear()
+            if self._db is None:
+                return 0
+            try:
+                return self._db.execute('DELETE FROM cache WHERE model = ? AND ts <= ?', (self.model, cutoff)).rowcount
+            except sqlite3.Error as e:
+                logger.warning("Could not clear classification cache: %s", e)
+                return 0
+    
     def classify_file(self, file_path):
-        """Classify a file using Ollama"""
+        """
+        Classify a file, using the cheapest method that gives an answer
+        
+        Known extensions are looked up directly, trivial names (temporary
+        files, dotfiles, hash-like stems) go to misc, then cached answers for
+        similarly named files are reused, then (if an embedding model is
+        configured) the name is matched against category embeddings, and
+        only if that is inconclusive is the generate model asked.
+        """
         if not self.enabled:
             return None
         
-        try:
-            file_name = file_path.name
-            file_ext = file_path.suffix.lower()
-            
-            # Build prompt for classification
-            prompt = f"""You are a file classification assistant. Classify the following file into ONE category.
-
-File name: {file_name}
-File extension: {file_ext}
-
-Available categories: {', '.join(self.categories)}
-
-Respond with ONLY the category name, nothing else. If uncertain, respond with 'misc'.
-
-Category:"""
-            
-            logger.debug(f"Classifying {file_name} with Ollama")
+        ext = file_path.suffix.lower()
+        category = self._ext_to_cat.get(ext)
+        if category is not None:
+            return category
+        if is_trivial_name(file_path):
+            return self._misc
+        
+        key = (ext, stem_signature(file_path))
+        category = self._cache_get(key)
+        if category is None:
+            category = self._classify_uncached(file_path)
+            if category is not None:
+                self._cache_put((key, category))
+        return category
+    
+    def classify_files(self, file_paths, concurrency=8):
+        """
+        Classify many files concurrently
+        
+        Requests are issued through ollama.AsyncClient with at most
+        `concurrency` in flight, spread over ollama.endpoints if configured;
+        a server only processes them in parallel if started with
+        OLLAMA_NUM_PARALLEL >= concurrency. Concurrency is
+        halved whenever decoding slows down, which means the server is
+        queueing or contending rather than serving requests in parallel.
+        
+        Returns a list of categories (or None) in the same order as file_paths.
+        """
+        if not self.enabled:
+            return [None] * len(file_paths)
+        
+        keys, categories, pending = self._split_cached(file_paths)
+        if pending:
+            if self.embedding_model:
+                self._category_vectors()  # Embed categories before going async
+            results = asyncio.run(self._gather(list(pending.values()), concurrency))
+            self._store_results(categories, pending, results)
+        
+        return [categories[key] for key in keys]
+    
+    def classify_batch(self, file_paths, k=16):
+        """
+        Classify files k at a time, packing each group into a single prompt
+        
+        The instructions and category list are only processed once per group
+        instead of once per file. Files the embedding tier resolves are left
+        out of the groups. Keep k small enough (8-16) that the prompt fits
+        the model's context. Returns categories in file_paths order.
+        """
+        if not self.enabled:
+            return [None] * len(file_paths)
+        
+        keys, categories, pending = self._split_cached(file_paths)
+        if pending:
+            group_paths = list(pending.values())
+            results = [
+                None if self._breaker_open() else self._classify_by_embedding(p)
+                for p in group_paths
+            ]
+            # Only files the embedding tier could not place go to the model
+            unresolved = [i for i, category in enumerate(results) if category is None]
+            for start in range(0, len(unresolved), k):
+                group = unresolved[start:start + k]
+                for i, category in zip(group, self._classify_group([group_paths[i] for i in group])):
+                    results[i] = category
+            self._store_results(categories, pending, results)
+        
+        return [categories[key] for key in keys]
+    
+    def _split_cached(self, file_paths):
+        """
+        Resolve file_paths by extension, trivial name or from the cache
+        
+        Returns (keys, categories, pending) where categories maps every key to
+        its known category or None, and pending maps each unresolved key to the
+        first file that has it.
+        """
+        keys = []
+        categories = {}
+        pending = {}
+        for file_path in file_paths:
+            ext = file_path.suffix.lower()
+            key = (ext, stem_signature(file_path))
+            keys.append(key)
+            if key in categories:
+                continue
             
-            # Call Ollama
-            response = self.client.generate(
-                model=self.model,
-                prompt=prompt,
-                options={
-                    'temperature': self.temperature,
-                    'num_predict': 20,  # Short response
-                }
+            category = self._ext_to_cat.get(ext)
+            if category is None and is_trivial_name(file_path):
+                category = self._misc
+            if category is None:
+                category = self._cache_get(key)
+                if category is None:
+                    pending[key] = file_path
+            categories[key] = category
+        return keys, categories, pending
+    
+    def _store_results(self, categories, pending, results):
+        """Record answers for pending keys in categories and the cache"""
+        answered = []
+        for key, category in zip(pending, results):
+            categories[key] = category
+            if category is not None:
+                answered.append((key, category))
+        if answered:
+            self._cache_put(*answered)
+    
+    def _tune_concurrency(self, concurrency, wave_size, baseline):
+        """Halve concurrency if the last wave decoded much slower than the first"""
+        per_token = self._eval_per_token(wave_size)
+        if per_token is None or baseline is None:
+            return concurrency, per_token
+        
+        if per_token > baseline * SLOWDOWN and concurrency > 1:
+            concurrency //= 2
+            logger.info(
+                "Ollama decode slowed to %.1fms/token (from %.1fms), lowering concurrency to %d",
+                per_token / 1e6, baseline / 1e6, concurrency,
             )
-            
-            # Extract category from response
-            category = response['response'].strip().lower()
-            
-            # Validate category
-            if category in self.categories:
-                logger.info(f"Ollama classified {file_name} as: {category}")
-                return category
+        return concurrency, baseline
+    
+    async def _gather(self, file_paths, concurrency):
+        """Classify files on one event loop in waves, each bounded by a semaphore"""
+        aclient = ollama.AsyncClient(
+            host=self.base_url,
+            timeout=self.timeout,
+            transport=httpx.AsyncHTTPTransport(retries=1, limits=self._http_limits()),
+        )
+        concurrency = max(1, concurrency)
+        self._endpoint_sems = {url: asyncio.Semaphore(self._endpoint_slots) for url in self._endpoints}
+        
+        async def classify(semaphore, file_path):
+            async with semaphore:
+                return await self._classify_one(aclient, file_path)
+        
+        try:
+            results = []
+            baseline = None
+            while len(results) < len(file_paths):
+                wave = file_paths[len(results):len(results) + concurrency * WAVE_ROUNDS]
+                semaphore = asyncio.Semaphore(concurrency)
+                results.extend(await asyncio.gather(*(classify(semaphore, p) for p in wave)))
+                concurrency, baseline = self._tune_concurrency(concurrency, len(wave), baseline)
+            return results
+        finally:
+            # The httpx connection pool belongs to this event loop
+            await aclient._client.aclose()
+    
+    def _build_prompt(self, file_path):
+        """Build the classification prompt for a file"""
+        return self._prompt_prefix + " name=" + file_path.name + " ext=" + file_path.suffix.lower() + "\nCode:"
+    
+    def _generate_body(self, prompt, options):
+        return fast_json.dumps({'model': self.model, 'prompt': prompt, 'stream': False, 'options': options})
+    
+    def _generate(self, prompt, options):
+        """POST to /api/generate and decode the raw JSON reply as a dict"""
+        response = self._http.post('/api/generate', content=self._generate_body(prompt, options), headers=JSON_HEADERS)
+        return self._decode_generate(response)
+    
+    def _decode_generate(self, response):
+        """Decode a generate reply, raising Ollama's own error message on failure"""
+        if response.is_error:
+            try:
+                error = fast_json.loads(response.content).get('error')
+            except (ValueError, AttributeError):
+                error = None
+            raise ollama.ResponseError(error or response.text, response.status_code)
+        
+        data = fast_json.loads(response.content)
+        self._record_latency(data)
+        return data
+    
+    async def _generate_async(self, http, prompt, options):
+        """Async _generate over an httpx.AsyncClient"""
+        response = await http.post('/api/generate', content=self._generate_body(prompt, options), headers=JSON_HEADERS)
+        return self._decode_generate(response)
+    
+    async def _generate_fleet(self, http, prompt):
+        """
+        Send a prompt to the next healthy endpoint's /v1/chat/completions
+        
+        Endpoints that time out or return a 5xx are quarantined for
+        QUARANTINE seconds and the next one is tried. Returns a dict shaped
+        like an /api/generate reply.
+        """
+        body = fast_json.dumps({
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'temperature': self.temperature,
+            'max_tokens': 2,
+            'stop': ['\n'],
+        })
+        last_error = None
+        start = next(self._endpoint_cycle)
+        for offset in range(len(self._endpoints)):
+            url = self._endpoints[(start + offset) % len(self._endpoints)]
+            if time.monotonic() < self._quarantined_until.get(url, 0.0):
+                continue
+            try:
+                async with self._endpoint_sems[url]:
+                    response = await http.post(f"{url}/v1/chat/completions", content=body, headers=JSON_HEADERS)
+                response.raise_for_status()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    raise
+                # Requests already in flight to the same endpoint fail together
+                if time.monotonic() >= self._quarantined_until.get(url, 0.0):
+                    logger.warning("Skipping Ollama endpoint %s for %.0fs: %s", url, QUARANTINE, e)
+                self._quarantined_until[url] = time.monotonic() + QUARANTINE
+                last_error = e
+                continue
+            data = fast_json.loads(response.content)
+            return {'response': data['choices'][0]['message']['content']}
+        
+        raise last_error or RuntimeError("All Ollama endpoints are quarantined")
+    
+    def _lookup_answer(self, answer):
+        """Map a category code (or spelled-out name) from the model to a category"""
+        match = self._answer_re.search(answer)
+        if match is None:
+            return None
+        code, name = match.groups()
+        if code:
+            return self._code_to_cat[code.lower()]
+        return self._categories_by_lower[name.lower()]
+    
+    def _parse_category(self, response, file_name):
+        """Extract and validate the category from an Ollama response"""
+        answer = response['response']
+        category = self._lookup_answer(answer)
+        
+        if category is not None:
+            logger.info("Ollama classified %s as: %s", file_name, category)
+            return category
+        else:
+            logger.warning("Ollama returned invalid category '%s' for %s", answer.strip(), file_name)
+            return None
+    
+    def _build_batch_prompt(self, file_paths):
+        """Build a prompt asking for one numbered answer per file"""
+        lines = [
+            f"{i}. name={p.name} ext={p.suffix.lower()}"
+            for i, p in enumerate(file_paths, 1)
+        ]
+        return self._batch_prompt_prefix + "\n".join(lines) + "\n"
+    
+    def _classify_group(self, file_paths):
+        """Classify a small group of files with a single Ollama call"""
+        if self._breaker_open():
+            return [None] * len(file_paths)
+        
+        try:
+            logger.debug("Classifying %d files with one Ollama call", len(file_paths))
+            response = self._generate(
+                self._build_batch_prompt(file_paths),
+                dict(
+                    self._options,
+                    num_ctx=max(self._options['num_ctx'], BATCH_NUM_CTX),
+                    num_predict=len(file_paths) * 6,  # "<n>: <code>\n" per file
+                )
+            )
+        except Exception as e:
+            logger.error("Error classifying %d files with Ollama: %s", len(file_paths), e)
+            self._record_failure(e)
+            return [None] * len(file_paths)
+        
+        self._record_success()
+        
+        answers = {}
+        for index, answer in BATCH_LINE_RE.findall(response['response']):
+            category = self._lookup_answer(answer)
+            if category is not None:
+                answers[int(index)] = category
+        
+        results = []
+        for i, file_path in enumerate(file_paths, 1):
+            category = answers.get(i)
+            if category is None:
+                logger.warning("Ollama gave no valid category for %s", file_path.name)
+            else:
+                logger.info("Ollama classified %s as: %s", file_path.name, category)
+            results.append(category)
+        return results
+    
+    def _embedding_text(self, file_path):
+        """Turn a file stem into words for the embedding model"""
+        return SEPARATORS_RE.sub(' ', file_path.stem).strip() or file_path.name
+    
+    def _category_vectors(self):
+        """Embed each category name once; an empty result skips the embedding tier"""
+        with self._embed_lock:
+            if self._cat_vecs is None:
+                try:
+                    self._cat_vecs = [
+                        _normalize(self.client.embeddings(model=self.embedding_model, prompt=category)['embedding'])
+                        for category in self.categories
+                    ]
+                except Exception as e:
+                    # Only a rejected request (e.g. model not pulled) disables the
+                    # tier for good; timeouts and server errors are retried next call
+                    if isinstance(e, ollama.ResponseError) and 400 <= e.status_code < 500:
+                        logger.warning("Embedding model %s unavailable, skipping embedding tier: %s", self.embedding_model, e)
+                        self._cat_vecs = []
+                    else:
+                        logger.warning("Could not embed categories with %s, will retry: %s", self.embedding_model, e)
+                        return []
+            return self._cat_vecs
+    
+    def _match_embedding(self, vector, file_name):
+        """Return the closest category if it is similar enough, else None"""
+        vector = _normalize(vector)
+        scores = [sum(a * b for a, b in zip(cat_vec, vector)) for cat_vec in self._cat_vecs]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        if scores[best] < self.embedding_threshold:
+            return None
+        
+        logger.info("Embedding classified %s as: %s (%.2f)", file_name, self.categories[best], scores[best])
+        return self.categories[best]
+    
+    def _classify_by_embedding(self, file_path):
+        """Tier 2: classify by embedding similarity, or None if inconclusive"""
+        if not self.embedding_model or not self._category_vectors():
+            return None
+        
+        try:
+            response = self.client.embeddings(model=self.embedding_model, prompt=self._embedding_text(file_path))
+            return self._match_embedding(response['embedding'], file_path.name)
+        except Exception as e:
+            logger.debug("Embedding lookup failed for %s: %s", file_path.name, e)
+            return None
+    
+    async def _classify_by_embedding_async(self, aclient, file_path):
+        """Tier 2 for the async path; category vectors must already be loaded"""
+        if not self._cat_vecs:
+            return None
+        
+        try:
+            response = await aclient.embeddings(model=self.embedding_model, prompt=self._embedding_text(file_path))
+            return self._match_embedding(response['embedding'], file_path.name)
+        except Exception as e:
+            logger.debug("Embedding lookup failed for %s: %s", file_path.name, e)
+            return None
+    
+    def _classify_uncached(self, file_path):
+        """Ask Ollama to classify a file"""
+        if self._breaker_open():
+            return None
+        
+        category = self._classify_by_embedding(file_path)
+        if category is not None:
+            return category
+        
+        try:
+            logger.debug("Classifying %s with Ollama", file_path.name)
+            response = self._generate(self._build_prompt(file_path), self._single_options)
+        except Exception as e:
+            logger.error("Error classifying %s with Ollama: %s", file_path, e)
+            self._record_failure(e)
+            return None
+        
+        self._record_success()
+        return self._parse_category(response, file_path.name)
+    
+    async def _classify_one(self, aclient, file_path):
+        """Ask Ollama to classify a file without blocking the event loop"""
+        if self._breaker_open():
+            return None
+        
+        category = await self._classify_by_embedding_async(aclient, file_path)
+        if category is not None:
+            return category
+        
+        try:
+            logger.debug("Classifying %s with Ollama", file_path.name)
+            if self._endpoints:
+                response = await self._generate_fleet(aclient._client, self._build_prompt(file_path))
             else:
-                logger.warning(f"Ollama returned invalid category '{category}' for {file_name}")
-                return None
-                
+                response = await self._generate_async(aclient._client, self._build_prompt(file_path), self._single_options)
         except Exception as e:
-            logger.error(f"Error classifying {file_path} with Ollama: {e}")
+            logger.error("Error classifying %s with Ollama: %s", file_path, e)
+            self._record_failure(e)
             return None
+        
+        self._record_success()
+        return self._parse_category(response, file_path.name)
+    
+    def probe(self):
+        """
+        Classify the canned PROBE_FILES with the generate model alone
+        
+        Caches, the embedding tier and the circuit breaker are bypassed so
+        only the model is measured. Samples whose category is not configured
+        are left out; after FAIL_THRESHOLD failed requests in a row the rest
+        are skipped. Returns (correct, answered, skipped, seconds).
+        """
+        samples = [(Path(name), category) for name, category in PROBE_FILES if category in self.categories]
+        correct = answered = failures = 0
+        start = time.perf_counter()
+        for file_path, category in samples:
+            try:
+                response = self._generate(self._build_prompt(file_path), self._single_options)
+            except Exception as e:
+                logger.warning("Probe request for %s failed: %s", file_path.name, e)
+                failures += 1
+                if failures >= FAIL_THRESHOLD:
+                    break
+                continue
+            failures = 0
+            answered += 1
+            correct += self._parse_category(response, file_path.name) == category
+        return correct, answered, len(samples) - answered, time.perf_counter() - start
+    
+    def _probe_endpoints(self):
+        """Raise unless at least one of ollama.endpoints answers GET /v1/models"""
+        errors = []
+        for url in self._endpoints:
+            try:
+                self._http.get(f"{url}/v1/models").raise_for_status()
+                return
+            except httpx.HTTPError as e:
+                errors.append(f"{url}: {e}")
+        raise ConnectionError("no endpoint reachable (" + "; ".join(errors) + ")")
+    
+    def _model_installed(self, listing):
+        """True if self.model is among the listed models, warning otherwise"""
+        names = {m['model'] for m in listing['models']}
+        if self.model in names or f"{self.model}:latest" in names:
+            return True
+        logger.warning("Ollama model %s is not installed; run `ollama pull %s`", self.model, self.model)
+        return False
     
     def is_available(self):
         """Check if Ollama is available and running"""
         if not self.enabled:
             return False
         
+        cached = self._avail_cached
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        
         try:
-            # Try to list models to check if server is running
-            self.client.list()
-            return True
+            if self._endpoints:
+                # classify_files talks to the fleet, not base_url
+                self._probe_endpoints()
+                available = True
+            else:
+                # Try to list models to check if server is running
+                available = self._model_installed(self.client.list())
         except Exception as e:
-            logger.warning(f"Ollama server not available: {e}")
-            return False
+            logger.warning("Ollama server not available: %s", e)
+            available = False
+        
+        self._avail_cached = (available, time.monotonic() + AVAILABILITY_TTL)
+        return available